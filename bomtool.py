@@ -1,12 +1,29 @@
 #!/usr/bin/python3
 
+import os
 import bomtool
+import natsort # type: ignore
+import collections
 
 def main(argv):
     import argparse
+
+    if len(argv) > 1 and argv[1] == "index":
+        return main_index(argv)
+    if len(argv) > 1 and argv[1] == "query":
+        return main_query(argv)
+
+    def positive_int(value):
+        n = int(value)
+        if n < 1:
+            raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+        return n
+
     parser = argparse.ArgumentParser(
         prog=argv[0],
-        description="Synchronize BOM between files and manage variants")
+        description="Synchronize BOM between files and manage variants",
+        epilog="See also: '%(prog)s index --help' to build a where-used " +
+        "index over many BOMs, and '%(prog)s query --help' to search it.")
 
     group = parser.add_argument_group('Input Options')
     ex = group.add_mutually_exclusive_group(required=True)
@@ -24,28 +41,71 @@ def main(argv):
     ex.add_argument("-O", "--out-eagle", metavar=("SCH", "BRD"), nargs=2,
                     help="Inject attributes into Eagle files")
 
+    group.add_argument("-t", "--eagle-target", action="append",
+                       metavar=("VAR1[,VAR2]...", "SCH", "BRD"), nargs=3,
+                       help="With Eagle output, also write the given " +
+                       "variants to separate Eagle files (may be repeated)")
     group.add_argument("-e", "--eagle-value", action="store_true",
                        help="With Eagle input, include Eagle value in output")
     group.add_argument("-s", "--separate", action="store_true",
                        help="In spreadsheets, output one designator per row")
+    group.add_argument("--no-stream", action="store_true",
+                       help="With --separate, read the whole BOM before " +
+                       "writing CSV output, instead of streaming it")
+    group.add_argument("--sort-chunk", metavar="ROWS", type=positive_int,
+                       default=100000,
+                       help="When streaming, sort at most this many rows " +
+                       "in memory (default: %(default)s)")
+
+    group = parser.add_argument_group('Field Options')
+    group.add_argument("-c", "--config", metavar="FILE",
+                       help="Load extra BOM fields from a JSON config file")
+
+    group = parser.add_argument_group('Part Data Enrichment')
+    group.add_argument("--enrich", metavar="DB",
+                       help="Fill in status and alternatives from a " +
+                       "SQLite part catalog")
+    group.add_argument("--enrich-cache", metavar="FILE",
+                       help="Cache part lookups in this file")
+    group.add_argument("--enrich-ttl", metavar="SECONDS", type=float,
+                       default=86400,
+                       help="Expire cached part lookups after this long " +
+                       "(default: %(default)s)")
+
+    group = parser.add_argument_group('Incremental Builds')
+    group.add_argument("-m", "--manifest", metavar="FILE",
+                       help="Skip work if outputs recorded in this " +
+                       "manifest are up to date, and record new outputs")
 
     group = parser.add_argument_group('Variant Filtering')
     group.add_argument("-v", "--variant", metavar="VAR1[,VAR2]...",
                        help="Variant rule flags, comma-separated")
 
     args = parser.parse_args(argv[1:])
+    if args.eagle_target and not args.out_eagle:
+        parser.error("--eagle-target requires --out-eagle")
     run(vars(args))
 
 def run(args):
-    bom = bomtool.BOM()
+    # Skip everything if the outputs are already up to date
+    if args['manifest']:
+        manifest = bomtool.Manifest(args['manifest'])
+        (out_files, key) = manifest_key(args)
+        if manifest.up_to_date(out_files, key):
+            print(f"Skipping {' '.join(out_files)}, already up to date")
+            return
+
+    if args['config']:
+        schema = bomtool.Schema.load(args['config'])
+    else:
+        schema = bomtool.DEFAULT_SCHEMA
 
     # Read input
     if args['in']:
-        reader = bomtool.SheetReader(args['in'])
+        reader = bomtool.SheetReader(args['in'], schema)
     else:
         (sch, brd) = args['in_eagle']
-        reader = bomtool.EagleReader(sch, brd)
-    bom.read(reader)
+        reader = bomtool.EagleReader(sch, brd, schema)
 
     if args['variant']:
         variants = args['variant'].split(',')
@@ -54,16 +114,162 @@ def run(args):
         variants = None
         print(f"Extracting master BOM for all variants")
 
+    # Separate rows written to CSV don't need the whole BOM in memory,
+    # so stream them straight from the reader to the writer
+    if (args['out'] and args['out'].endswith('.csv') and args['separate']
+        and not args['enrich'] and not args['no_stream']
+        and not same_file(args['out'], args['in'])):
+        writer = bomtool.CSVWriter(args['out'],
+                                   merge=False,
+                                   eagle_value=args['eagle_value'],
+                                   schema=schema)
+        parts = reader()
+        if variants is not None:
+            parts = bomtool.filter_parts(parts, variants)
+        writer.stream(parts, variants, args['sort_chunk'])
+        if args['manifest']:
+            manifest.record(out_files, key)
+        return
+
+    bom = bomtool.BOM()
+    bom.read(reader)
+
+    # Fill in part data
+    if args['enrich']:
+        backend = bomtool.SQLiteBackend(args['enrich'])
+        cache = None
+        if args['enrich_cache']:
+            cache = bomtool.LookupCache(args['enrich_cache'],
+                                        args['enrich_ttl'])
+        try:
+            bom.enrich(bomtool.Enricher(backend, cache))
+        finally:
+            backend.close()
+            if cache:
+                cache.close()
+
     # Write output
     if args['out']:
         writer = bomtool.SheetWriter(args['out'],
                                      merge=not args['separate'],
-                                     eagle_value=args['eagle_value'])
+                                     eagle_value=args['eagle_value'],
+                                     schema=schema)
+        bom.write(writer, variants)
     else:
+        # Write all Eagle outputs from a single parse of the files
         (sch, brd) = args['out_eagle']
-        writer = bomtool.EagleWriter(sch, brd)
-    bom.write(writer, variants)
+        writer = bomtool.EagleWriter(sch, brd, schema)
+        outputs = [ (bom.filter(variants).parts, variants, sch, brd) ]
+        for (target, sch, brd) in args['eagle_target'] or []:
+            target_variants = target.split(',')
+            print(f"Extracting BOM for variant: {' '.join(target_variants)}")
+            outputs.append((bom.filter(target_variants).parts,
+                            target_variants, sch, brd))
+        writer.write_outputs(outputs)
+
+    if args['manifest']:
+        # Record the key from before the run, which describes the inputs
+        # that were actually read
+        manifest.record(out_files, key)
+
+def same_file(a, b):
+    """Return True if both paths refer to the same existing file"""
+    try:
+        return b is not None and os.path.samefile(a, b)
+    except FileNotFoundError:
+        return False
+
+def manifest_key(args):
+    """Return the list of output files, and the manifest key describing
+    everything that went into them.  Eagle files written in place are
+    outputs rather than inputs; if they change, their hash won't match.
+    A spreadsheet that is both input and output is rewritten, so it
+    won't match the recorded key, and is rebuilt on the next run."""
+    inputs = [ args['in'] ] if args['in'] else list(args['in_eagle'])
+    if args['config']:
+        inputs.append(args['config'])
+    if args['enrich']:
+        inputs.append(args['enrich'])
+
+    if args['out']:
+        outputs = [ args['out'] ]
+    else:
+        outputs = list(args['out_eagle'])
+        for (target, sch, brd) in args['eagle_target'] or []:
+            outputs += [ sch, brd ]
+
+    options = { k: args[k] for k in ('variant', 'eagle_target',
+                                     'separate', 'eagle_value') }
+    return (outputs, bomtool.Manifest.make_key(inputs, options,
+                                               [ os.path.abspath(__file__) ]))
+
+def main_index(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog=f"{argv[0]} index",
+        description="Add BOMs to a where-used index.  Projects are only " +
+        "re-read if their input files have changed.")
+    parser.add_argument("db", metavar="DB", help="Index database")
+    parser.add_argument("-i", "--in", metavar="FILE", action="append",
+                        default=[],
+                        help="Index spreadsheet, based on extension " +
+                        "(csv, ods, xlsx) (may be repeated)")
+    parser.add_argument("-I", "--in-eagle", metavar=("SCH", "BRD"), nargs=2,
+                        action="append", default=[],
+                        help="Index Eagle files (may be repeated)")
+    parser.add_argument("-r", "--remove", metavar="FILE", action="append",
+                        default=[],
+                        help="Remove the project read from FILE from the " +
+                        "index (may be repeated)")
+    args = parser.parse_args(argv[2:])
+
+    # Projects are named after the real path of their input file, so
+    # the same project is found from any directory
+    index = bomtool.WhereUsedIndex(args.db)
+    for path in args.remove:
+        if index.remove(os.path.realpath(path)):
+            print(f"Removed {path}")
+    for path in getattr(args, 'in'):
+        if index.update(os.path.realpath(path), [ path ],
+                        bomtool.SheetReader(path)):
+            print(f"Indexed {path}")
+    for (sch, brd) in args.in_eagle:
+        if index.update(os.path.realpath(sch), [ sch, brd ],
+                        bomtool.EagleReader(sch, brd)):
+            print(f"Indexed {sch}")
+    index.close()
+
+def main_query(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog=f"{argv[0]} query",
+        description="Find every project and variant that uses a part")
+    parser.add_argument("db", metavar="DB", help="Index database")
+    parser.add_argument("part", metavar="PART",
+                        help="Manufacturer or supplier part number")
+    parser.add_argument("-m", "--manufacturer",
+                        help="Only match parts from this manufacturer")
+    args = parser.parse_args(argv[2:])
+
+    index = bomtool.WhereUsedIndex(args.db)
+    uses = collections.defaultdict(list)
+    for (project, rules, desig, *info) in index.query(args.part,
+                                                      args.manufacturer):
+        uses[(project, rules, *info)].append(desig)
+    index.close()
+
+    for key in sorted(uses):
+        (project, rules, manufacturer, part, supplier_part) = key
+        desig = ' '.join(natsort.natsorted(uses[key]))
+        line = (f"{os.path.relpath(project)}: "
+                f"{manufacturer} {part} ({supplier_part}) {desig}")
+        if rules:
+            line += f" [{rules}]"
+        print(line)
+    if not uses:
+        print(f"{args.part} is not used")
+        return 1
 
 if __name__ == "__main__":
     import sys
-    main(sys.argv)
+    sys.exit(main(sys.argv))
@@ -1,4 +1,8 @@
-from .bom import BOM
+from .bom import BOM, filter_parts
+from .schema import Field, Schema, DEFAULT_SCHEMA
 from .csv import CSVReader, CSVWriter
 from .sheet import SheetReader, SheetWriter
 from .eagle import EagleReader, EagleWriter
+from .manifest import Manifest
+from .enrich import Enricher, EnrichBackend, SQLiteBackend, LookupCache
+from .index import WhereUsedIndex
@@ -4,7 +4,7 @@ import copy
 import collections
 import dataclasses
 
-from typing import Optional, Generator
+from typing import Optional, Generator, Iterable
 
 def log(fmt, *args):
     if isinstance(fmt, str):
@@ -34,6 +34,7 @@ class Info:
     dnp: bool = False       # goes into "Notes" field in CSV
     eagle_value: str = ""   # Only filled when reading Eagle files
     eagle_package: str = "" # Only filled when reading Eagle files
+    extra: tuple[tuple[str, str], ...] = () # Extra fields from Schema
 
 Variants = list[tuple[VariantRules, Info]]
 
@@ -57,6 +58,11 @@ class BOMWriter:
         """Write all of the parts."""
         raise NotImplementedError("subclass needs to define this")
 
+class BOMEnricher:
+    def __call__(self, parts: dict[str, Part]) -> None:
+        """Update info for the parts in place."""
+        raise NotImplementedError("subclass needs to define this")
+
 class BOM:
     # Mapping between designator and a list of variants for this part
     parts: dict[Desig, Part]
@@ -76,29 +82,29 @@ class BOM:
         for part in reader():
             self.append(part)
 
+    def enrich(self, enricher: BOMEnricher) -> None:
+        """Update BOM data using the specified enricher"""
+        enricher(self.parts)
+
     def write(self, writer: BOMWriter,
               variants: Optional[list[str]] = None) -> None:
         """Filter BOM according to the given variants, and send to
         the specified writer."""
+        writer(self.filter(variants).parts, variants)
+
+    def filter(self, variants: Optional[list[str]] = None) -> 'BOM':
+        """Return a BOM filtered according to the given variants.  If
+        no variants are specified, this BOM is returned as-is."""
 
         if variants is None:
             # No variants specified, so write everything as-is
-            out_bom = self
+            return self
 
-        else:
-            # Process variant rules and filter things out
-            out_bom = BOM()
-            for (desig, part) in self.parts.items():
-                for (rules, info) in copy.deepcopy(part.variants):
-                    flags = parse_variant_rules(rules, variants)
-                    # Variant rule can only _set_ DNP; it may already be
-                    # true because of the Notes field in the file.
-                    if flags["dnp"]:
-                        info.dnp = True
-                    if not flags["exclude"]:
-                        out_bom.append(Part(desig, [(rules, info)]))
-
-        writer(out_bom.parts, variants)
+        # Process variant rules and filter things out
+        out_bom = BOM()
+        for part in filter_parts(self.parts.values(), variants):
+            out_bom.append(part)
+        return out_bom
 
     # Print all parts
     def __str__(self) -> str:
@@ -145,6 +151,20 @@ class VariantRuleEngine(dict):
         # No key -- assume False
         return False
 
+def filter_parts(parts: Iterable[Part],
+                 variants: list[str]) -> Generator[Part, None, None]:
+    """Filter parts according to the given variants, yielding a
+    separate Part for each variant that isn't excluded."""
+    for part in parts:
+        for (rules, info) in copy.deepcopy(part.variants):
+            flags = parse_variant_rules(rules, variants)
+            # Variant rule can only _set_ DNP; it may already be
+            # true because of the Notes field in the file.
+            if flags["dnp"]:
+                info.dnp = True
+            if not flags["exclude"]:
+                yield Part(part.desig, [(rules, info)])
+
 def parse_variant_rules(rules: VariantRules,
                         variants: list[str]) -> dict[str, bool]:
     """Parse variant rules, which are Python expressions that
@@ -1,10 +1,15 @@
+import os
 import re
 import csv
+import heapq
 import typing
+import tempfile
+import itertools
 import natsort # type: ignore
 import collections
 
 from .bom import *
+from .schema import Schema, DEFAULT_SCHEMA
 
 class DataError(Exception):
     def __init__(self, data, message=""):
@@ -13,58 +18,55 @@ class DataError(Exception):
 
 class CSVReader(BOMReader):
     path: str
+    schema: Schema
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, schema: Schema = DEFAULT_SCHEMA) -> None:
         self.path = path
+        self.schema = schema
 
     def __call__(self) -> typing.Generator[Part, None, None]:
         with open(self.path, "r") as f:
             reader = csv.DictReader(f, restval='')
+            fieldnames = list(reader.fieldnames or [])
+
+            try:
+                extract = self.schema.csv_extractor(fieldnames)
+            except KeyError as e:
+                raise DataError(fieldnames,
+                                f"Expected field {e.args[0]} not in CSV")
+            column = self.schema.column
+            (notes_col, qty_col, desig_col, rules_col) = (
+                column('dnp'), column('qty'), column('desig'), column('rules'))
 
             # For each row in the CSV, extract designators and add to BOM
             for row in reader:
 
-                def field(name: str) -> str:
-                    if name not in row:
-                        raise DataError(reader.fieldnames,
-                                        f"Expected field {name} not in CSV")
-                    return row[name]
-
                 if not any(row[k] != "" for k in row):
                     continue
 
                 # Designators are separated by whitespace, commas, etc
-                desig = re.split(' *[;, ] *', field('Designators'))
+                desig = re.split(' *[;, ] *', row[desig_col])
 
                 def warn(msg: str):
                     print(f'Warning: {msg} for designators ' + ' '.join(desig))
 
-                info = Info(package=field('Package'),
-                            description=field('Description'),
-                            manufacturer=field('Manufacturer'),
-                            part=field('Part'),
-                            supplier=field('Supplier'),
-                            supplier_part=field('Supplier part'),
-                            notes=field('Other notes'),
-                            alternatives=field('Alternatives'),
-                            status=field('Status'),
-                    )
+                info = extract(row)
 
                 # Notes field should just contain DNP or be empty
-                notes = field('Notes')
+                notes = row[notes_col]
                 if notes == 'DNP':
                     info.dnp = True
                 elif notes != '':
                     warn(f'ignoring unknown notes "{notes}"')
 
                 # If DNP, quantity should be zero, otherwise, it should match
-                if info.dnp and int(field('Qty')) != 0:
+                if info.dnp and int(row[qty_col]) != 0:
                     warn(f"quantity should be zero for DNP parts")
-                if not info.dnp and int(field('Qty')) != len(desig):
-                    warn(f"wrong quantity {field('Qty')}")
+                if not info.dnp and int(row[qty_col]) != len(desig):
+                    warn(f"wrong quantity {row[qty_col]}")
 
                 # Ensure we can parse the variant rules
-                rules = field('Variant rule')
+                rules = row[rules_col]
                 try:
                     parse_variant_rules(rules, [])
                 except (SyntaxError, TypeError) as e:
@@ -76,26 +78,23 @@ class CSVReader(BOMReader):
 
 class CSVWriter(BOMWriter):
     path: str
-    printed_header: bool
     csv: typing.IO
     merge: bool
     eagle_value: bool
+    schema: Schema
 
     def __init__(self, path: str,
                  merge: bool=True,
-                 eagle_value: bool=False) -> None:
+                 eagle_value: bool=False,
+                 schema: Schema = DEFAULT_SCHEMA) -> None:
         self.path = path
         self.merge = merge
         self.eagle_value = eagle_value
+        self.schema = schema
 
-    def write_csv_line(self, keyval: collections.OrderedDict[str, str]):
+    def write_csv_line(self, values: list[str]):
         row = []
-        if not self.printed_header:
-            self.printed_header = True
-            header = collections.OrderedDict([ (k, k) for k in keyval ])
-            self.write_csv_line(header)
-
-        for (k, v) in keyval.items():
+        for v in values:
             if '"' in v:
                 raise Exception(f"Can't handle double quotes in CSV file: {v}")
             if ',' in v or ' ' in v:
@@ -143,39 +142,93 @@ class CSVWriter(BOMWriter):
                 out_parts[part.desig] = part
 
         # Print all rows
-        self.printed_header = False
+        emit = self.schema.csv_emitter(self.eagle_value)
         with open(self.path, "w") as self.csv:
+            self.write_csv_line(self.schema.csv_columns(self.eagle_value))
             for desig in natsort.natsorted(out_parts):
                 for (rules, info) in out_parts[desig].variants:
-                    if info.dnp:
-                        notes = "DNP"
-                        qty = 0
-                    else:
-                        notes = ""
-                        qty = len(desig.split())
-
-                    row = collections.OrderedDict()
-                    row['Notes'] = notes
-                    row['Qty'] = str(qty)
-                    row['Package'] = info.package
-                    row['Description'] = info.description
-                    row['Manufacturer'] = info.manufacturer
-                    row['Part'] = info.part
-                    row['Designators'] = desig
-                    row['Supplier'] = info.supplier
-                    row['Supplier part'] = info.supplier_part
-                    if hide_variant_rules:
-                        row['Variant rule'] = ''
-                    else:
-                        row['Variant rule'] = rules
-                    row['Other notes'] = info.notes
-                    row['Alternatives'] = info.alternatives
-                    row['Status'] = info.status
-                    if self.eagle_value:
-                        row['Eagle value'] = info.eagle_value
-                        row['Eagle package'] = info.eagle_package
-                    self.write_csv_line(row)
+                    self.write_csv_line(self.make_row(emit, desig, rules, info,
+                                                      hide_variant_rules))
+        self.print_wrote(variants)
+
+    def stream(self, parts: typing.Iterable[Part],
+               variants: Optional[list[str]],
+               chunk_size: int = 100000) -> None:
+        """Write parts one designator per row, as they arrive, without
+        holding the whole BOM in memory.  Rows that arrive sorted by
+        designator are written straight through.  After the first row
+        that's out of order, the rest are sorted with an external merge
+        sort (holding at most chunk_size rows), then merged with the rows
+        already written."""
+        if self.merge:
+            raise ValueError("Can only stream with merge=False")
+
+        hide_variant_rules = variants is not None
+        emit = self.schema.csv_emitter(self.eagle_value)
+        rows = iter(self.make_row(emit, part.desig, rules, info,
+                                  hide_variant_rules)
+                    for part in parts
+                    for (rules, info) in part.variants)
+
+        # Sort by designator, keeping file order for the same designator
+        desig_col = self.schema.csv_columns(False).index(
+            self.schema.column('desig'))
+        natkey = natsort.natsort_keygen()
+        def key(row: list[str]) -> tuple:
+            return (natkey(row[desig_col]), row[desig_col])
 
+        columns = self.schema.csv_columns(self.eagle_value)
+
+        # Write rows straight through while they're in order
+        unsorted = None
+        with open(self.path, "w") as self.csv:
+            self.write_csv_line(columns)
+            last = None
+            for row in rows:
+                row_key = key(row)
+                if last is not None and row_key < last:
+                    unsorted = row
+                    break
+                self.write_csv_line(row)
+                last = row_key
+
+        if unsorted is not None:
+            # Sort the rest, and merge with the rows written so far.  On
+            # equal keys, heapq.merge prefers the rows written first.
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.TemporaryDirectory(dir=directory) as tempdir:
+                written = os.path.join(tempdir, "written.csv")
+                os.replace(self.path, written)
+                rest = external_sort(itertools.chain([ unsorted ], rows),
+                                     key, chunk_size)
+                with open(written, newline='') as f:
+                    reader = csv.reader(f)
+                    next(reader)
+                    with open(self.path, "w") as self.csv:
+                        self.write_csv_line(columns)
+                        for row in heapq.merge(reader, rest, key=key):
+                            self.write_csv_line(row)
+
+        self.print_wrote(variants)
+
+    def make_row(self, emit: typing.Callable, desig: str, rules: str,
+                 info: Info, hide_variant_rules: bool) -> list[str]:
+        """Build the output row for one variant of a designator"""
+        if info.dnp:
+            notes = "DNP"
+            qty = 0
+        else:
+            notes = ""
+            qty = len(desig.split())
+
+        if hide_variant_rules:
+            rules = ''
+        return emit({ 'dnp': notes,
+                      'qty': str(qty),
+                      'desig': desig,
+                      'rules': rules }, info)
+
+    def print_wrote(self, variants: Optional[list[str]]) -> None:
         if variants is None:
             print(f"Wrote {self.path} as master BOM for all variants")
         elif len(variants) == 0:
@@ -183,4 +236,36 @@ class CSVWriter(BOMWriter):
         else:
             print(f"Wrote {self.path} for variants: {' '.join(variants)}")
 
+def external_sort(rows: typing.Iterable[list[str]],
+                  key: typing.Callable[[list[str]], typing.Any],
+                  chunk_size: int) -> typing.Iterator[list[str]]:
+    """Stable sort of rows, holding at most chunk_size of them in memory.
+    Each full chunk is sorted and spilled to a temporary file, and the
+    files are then merged.  On equal keys, heapq.merge prefers earlier
+    files, so the sort stays stable."""
+    assert chunk_size > 0
+    with tempfile.TemporaryDirectory() as tempdir:
+        runs: list[str] = []
+        it = iter(rows)
+        while True:
+            chunk = sorted(itertools.islice(it, chunk_size), key=key)
+            if len(chunk) < chunk_size and not runs:
+                # Everything fit in memory
+                yield from chunk
+                return
+
+            # Spill sorted chunk
+            if chunk:
+                path = os.path.join(tempdir, f"run{len(runs)}.csv")
+                with open(path, "w", newline='') as f:
+                    csv.writer(f).writerows(chunk)
+                runs.append(path)
+            if len(chunk) < chunk_size:
+                break
 
+        files = [ open(path, newline='') for path in runs ]
+        try:
+            yield from heapq.merge(*map(csv.reader, files), key=key)
+        finally:
+            for f in files:
+                f.close()
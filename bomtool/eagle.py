@@ -1,18 +1,25 @@
 import typing
+import collections
 import lxml.etree # type: ignore
 
 from .bom import *
+from .schema import Schema, DEFAULT_SCHEMA
 
 class EagleError(Exception):
     pass
 
+VARIANT_RE = re.compile(r'^BOM_VAR_([0-9]+)_')
+
 class EagleReader:
     sch: str
     brd: str
+    schema: Schema
 
-    def __init__(self, sch: str, brd: str) -> None:
+    def __init__(self, sch: str, brd: str,
+                 schema: Schema = DEFAULT_SCHEMA) -> None:
         self.sch = sch
         self.brd = brd
+        self.schema = schema
 
     def __call__(self) -> typing.Generator[Part, None, None]:
 
@@ -23,6 +30,7 @@ class EagleReader:
             brd = lxml.etree.parse(f)
 
         missing_bom = []
+        extract = self.schema.eagle_extractor()
 
         # Grab each part.  We use parts from the board, so that we
         # don't get schematic-only symbols (like GND).
@@ -44,7 +52,7 @@ class EagleReader:
             # Find all variants
             variants: dict[int, bool] = {}
             for key in data:
-                m = re.match(r'^BOM_VAR_([0-9]+)_', key)
+                m = VARIANT_RE.match(key)
                 if m:
                     variants[int(m.group(1))] = True
 
@@ -55,25 +63,13 @@ class EagleReader:
             # For each variant, yield the data
             for v in sorted(variants):
 
-                def get(name, defval=''):
-                    return data.get(f'BOM_VAR_{v}_{name}', defval)
-
-                info = Info(package=get('PACKAGE'),
-                            description=get('DESCRIPTION'),
-                            manufacturer=get('MANUFACTURER'),
-                            part=get('PART'),
-                            supplier=get('SUPPLIER'),
-                            supplier_part=get('SUPPLIER_PART'),
-                            notes=get('NOTES'),
-                            alternatives=get('ALTERNATIVES'),
-                            status=get('STATUS'),
-                            eagle_value=eagle_value,
-                            eagle_package=eagle_package,
-                            )
-                if get('DNP', False) == "1":
+                info = extract(data, v,
+                               eagle_value=eagle_value,
+                               eagle_package=eagle_package)
+                if data.get(f'BOM_VAR_{v}_DNP') == "1":
                     info.dnp = True
 
-                rules = get('VARIANT_RULES')
+                rules = data.get(f'BOM_VAR_{v}_VARIANT_RULES', '')
 
                 yield Part(desig=desig, variants=[ (rules, info) ])
 
@@ -83,16 +79,30 @@ class EagleReader:
             log(f"----");
 
 
+# Variants to write, along with the SCH and BRD output paths
+EagleOutput = tuple[dict[str, Part], Optional[list[str]], str, str]
+
 class EagleWriter:
     sch: str
     brd: str
+    schema: Schema
 
-    def __init__(self, sch: str, brd: str) -> None:
+    def __init__(self, sch: str, brd: str,
+                 schema: Schema = DEFAULT_SCHEMA) -> None:
         self.sch = sch
         self.brd = brd
+        self.schema = schema
 
     def __call__(self, parts: dict[str, Part],
                  variants: Optional[list[str]]) -> None:
+        """Write parts back into the original SCH and BRD files"""
+        self.write_outputs([ (parts, variants, self.sch, self.brd) ])
+
+    def write_outputs(self, outputs: list[EagleOutput]) -> None:
+        """Write several variants, each to its own SCH and BRD paths.
+        The original files are only parsed once; for each output, the
+        per-part attributes are added, the trees are serialized, and
+        the added attributes are removed again."""
 
         # Read the SCH and BRD files
         with open(self.sch) as f:
@@ -112,34 +122,59 @@ class EagleWriter:
                              'POPULATE' )):
                 elem.getparent().remove(elem)
 
-        def set_attribute(elem, name, value):
-            att = lxml.etree.SubElement(elem, "attribute")
-            # Copy "tail" of element to the new attribute, to match
-            # Eagle output formatting
-            att.tail = elem.tail
-            att.set("name", name)
-            att.set("value", value)
-            if elem.get("x") is not None:
-                # Board attributes need position/display data
-                att.set("x", elem.get("x"))
-                att.set("y", elem.get("y"))
-                att.set("size", "1")
-                att.set("layer", "27")
-                att.set("rot", "R180")
-                att.set("display", "off")
+        # Index elements by designator, so lookups don't scan the files
+        sch_elems: dict[str, list] = collections.defaultdict(list)
+        for elem in sch.findall('/drawing/schematic/parts/part'):
+            sch_elems[elem.get('name')].append(elem)
+        brd_elems: dict[str, list] = collections.defaultdict(list)
+        for elem in brd.findall('/drawing/board/elements/element'):
+            brd_elems[elem.get('name')].append(elem)
+
+        # Work out and validate the attributes for every output first, so
+        # a bad output can't leave others partially written
+        plans = [ self.plan_attributes(sch_elems, brd_elems, parts, variants)
+                  for (parts, variants, sch_out, brd_out) in outputs ]
+
+        for (plan, (parts, variants, sch_out, brd_out)) in zip(plans, outputs):
+            added = self.apply_attributes(plan)
+            try:
+                # Write the SCH and BRD files
+                for (tree, outfile) in [ (sch, sch_out), (brd, brd_out) ]:
+                    with open(outfile, "w") as f:
+                        f.seek(0)
+                        f.write(lxml.etree.tostring(tree).decode("utf-8"))
+                        f.write('\n')
+                        f.truncate()
+            finally:
+                # Revert to the stripped trees for the next output
+                for att in reversed(added):
+                    att.getparent().remove(att)
+
+    def plan_attributes(self, sch_elems: dict[str, list],
+                        brd_elems: dict[str, list],
+                        parts: dict[str, Part],
+                        variants: Optional[list[str]]
+                        ) -> list[tuple[typing.Any, str, str]]:
+        """Return the (element, name, value) attributes to add for all
+        parts, raising EagleError if the parts can't be written."""
+        plan = []
+        emit = self.schema.eagle_emitter()
 
         # For every part, populate attributes in both
         for part in parts.values():
-            sch_elem = sch.findall(
-                f'/drawing/schematic/parts/part[@name="{part.desig}"]')
+            sch_elem = sch_elems.get(part.desig, [])
             if len(sch_elem) != 1:
                 raise EagleError(f"Part {part.desig} not found in schematic")
 
-            brd_elem = brd.findall(
-                f'/drawing/board/elements/element[@name="{part.desig}"]')
+            brd_elem = brd_elems.get(part.desig, [])
             if len(brd_elem) != 1:
                 raise EagleError(f"Part {part.desig} not found in board")
 
+            if variants and len(part.variants) != 1:
+                raise EagleError(f"A variant was selected, but " +
+                                 f"{part.desig} still has more than " +
+                                 f"one option")
+
             # Populate attributes in schematic and board
             for elem in (sch_elem[0], brd_elem[0]):
 
@@ -147,21 +182,14 @@ class EagleWriter:
                 for (n, (rules, info)) in enumerate(part.variants):
 
                     def add(name, value):
-                        set_attribute(elem, f"BOM_VAR_{n}_{name}", value)
+                        plan.append((elem, f"BOM_VAR_{n}_{name}", value))
 
                     # Only add variant rules to Eagle if we haven't selected
                     # a variant.
                     if not variants:
                         add("VARIANT_RULES", rules)
-                    add("PACKAGE", info.package)
-                    add("DESCRIPTION", info.description)
-                    add("MANUFACTURER", info.manufacturer)
-                    add("PART", info.part)
-                    add("SUPPLIER", info.supplier)
-                    add("SUPPLIER_PART", info.supplier_part)
-                    add("NOTES", info.notes)
-                    add("ALTERNATIVES", info.alternatives)
-                    add("STATUS", info.status)
+                    for (name, value) in emit(info):
+                        add(name, value)
                     add("DNP", "1" if info.dnp else "0")
 
                 # If we did not select a variant, skip the attributes for
@@ -169,24 +197,36 @@ class EagleWriter:
                 if not variants:
                     continue
 
-                if len(part.variants) != 1:
-                    raise EagleError(f"A variant was selected, but " +
-                                     f"{part.desig} still has more than " +
-                                     f"one option")
-
                 (rules, info) = part.variants[0]
-                set_attribute(elem, "BOM_VARIANTS", " ".join(variants))
-                set_attribute(elem, "DNP", "1" if info.dnp else "0")
-                set_attribute(elem, "MANUFACTURER", info.manufacturer)
                 maybe_part = "NOT_POPULATED" if info.dnp else info.part
-                set_attribute(elem, "MPN", maybe_part)
-                set_attribute(elem, "PARTNUMBER", maybe_part)
-                set_attribute(elem, "POPULATE", "0" if info.dnp else "1")
-
-        # Write the SCH and BRD files
-        for (tree, outfile) in [ (sch, self.sch), (brd, self.brd) ]:
-            with open(outfile, "w") as f:
-                f.seek(0)
-                f.write(lxml.etree.tostring(tree).decode("utf-8"))
-                f.write('\n')
-                f.truncate()
+                plan += [ (elem, "BOM_VARIANTS", " ".join(variants)),
+                          (elem, "DNP", "1" if info.dnp else "0"),
+                          (elem, "MANUFACTURER", info.manufacturer),
+                          (elem, "MPN", maybe_part),
+                          (elem, "PARTNUMBER", maybe_part),
+                          (elem, "POPULATE", "0" if info.dnp else "1") ]
+
+        return plan
+
+    def apply_attributes(self, plan: list[tuple[typing.Any, str, str]]
+                         ) -> list:
+        """Add planned attributes, and return the list of newly created
+        attribute elements."""
+        added = []
+        for (elem, name, value) in plan:
+            att = lxml.etree.SubElement(elem, "attribute")
+            added.append(att)
+            # Copy "tail" of element to the new attribute, to match
+            # Eagle output formatting
+            att.tail = elem.tail
+            att.set("name", name)
+            att.set("value", value)
+            if elem.get("x") is not None:
+                # Board attributes need position/display data
+                att.set("x", elem.get("x"))
+                att.set("y", elem.get("y"))
+                att.set("size", "1")
+                att.set("layer", "27")
+                att.set("rot", "R180")
+                att.set("display", "off")
+        return added
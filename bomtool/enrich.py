@@ -0,0 +1,216 @@
+import json
+import time
+import queue
+import asyncio
+import sqlite3
+import dataclasses
+
+from typing import Optional
+
+from .bom import *
+from .manifest import hash_file
+
+# Lookups are either ("part", manufacturer, part) or
+# ("supplier_part", "", supplier_part), and are deduplicated separately
+Lookup = tuple[str, str, str]
+
+@dataclasses.dataclass
+class PartData:
+    """Part data returned by an enrichment backend.  Empty fields are
+    left unchanged in the BOM."""
+    status: str = ""
+    alternatives: str = ""
+
+class EnrichBackend:
+    def cache_id(self) -> str:
+        """Identify this backend and its data source, so that cached
+        results from different sources aren't mixed up."""
+        raise NotImplementedError("subclass needs to define this")
+
+    async def lookup(self, keys: list[Lookup]
+                     ) -> dict[Lookup, Optional[PartData]]:
+        """Look up a batch of parts, returning None for unknown parts."""
+        raise NotImplementedError("subclass needs to define this")
+
+    def close(self) -> None:
+        pass
+
+class SQLiteBackend(EnrichBackend):
+    """Local part catalog, for testing or offline use.  It has a single
+    table:
+
+        CREATE TABLE parts (manufacturer TEXT, part TEXT,
+                            supplier_part TEXT, status TEXT,
+                            alternatives TEXT)
+
+    "part" lookups match on (manufacturer, part), and "supplier_part"
+    lookups match on supplier_part."""
+    path: str
+    pool: queue.Queue
+
+    def __init__(self, path: str, connections: int = 4) -> None:
+        self.path = path
+        self.pool = queue.Queue()
+        for n in range(connections):
+            self.pool.put(sqlite3.connect(f"file:{path}?mode=ro", uri=True,
+                                          check_same_thread=False))
+
+    def cache_id(self) -> str:
+        # Cached results are invalidated when the catalog changes
+        return f"sqlite:{hash_file(self.path)}"
+
+    def query(self, keys: list[Lookup]) -> dict[Lookup, Optional[PartData]]:
+        # Borrow a connection from the pool for the whole batch
+        conn = self.pool.get()
+        try:
+            parts = sorted({ k[2] for k in keys if k[0] == "part" })
+            supplier_parts = sorted({ k[2] for k in keys
+                                      if k[0] == "supplier_part" })
+            rows = conn.execute(
+                f"SELECT manufacturer, part, supplier_part, status, "
+                f"alternatives FROM parts WHERE "
+                f"part IN ({','.join('?' * len(parts))}) OR "
+                f"supplier_part IN ({','.join('?' * len(supplier_parts))})",
+                parts + supplier_parts).fetchall()
+        finally:
+            self.pool.put(conn)
+
+        by_part = { (r[0], r[1]): PartData(r[3], r[4]) for r in rows }
+        by_supplier_part = { r[2]: PartData(r[3], r[4]) for r in rows if r[2] }
+
+        result: dict[Lookup, Optional[PartData]] = {}
+        for key in keys:
+            (kind, manufacturer, value) = key
+            if kind == "part":
+                result[key] = by_part.get((manufacturer, value))
+            else:
+                result[key] = by_supplier_part.get(value)
+        return result
+
+    async def lookup(self, keys: list[Lookup]
+                     ) -> dict[Lookup, Optional[PartData]]:
+        return await asyncio.to_thread(self.query, keys)
+
+    def close(self) -> None:
+        while not self.pool.empty():
+            self.pool.get().close()
+
+class LookupCache:
+    """On-disk cache of lookup results, which expire after ttl seconds.
+    Unknown parts are cached too, so they aren't looked up every time.
+    Results are stored under the backend's cache_id."""
+    path: str
+    ttl: float
+
+    def __init__(self, path: str, ttl: float = 86400) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                          "(key TEXT PRIMARY KEY, value TEXT, time REAL)")
+
+    def get(self, cache_id: str,
+            keys: list[Lookup]) -> dict[Lookup, Optional[PartData]]:
+        """Return cached results for any of the keys that haven't expired"""
+        result: dict[Lookup, Optional[PartData]] = {}
+        oldest = time.time() - self.ttl
+        for key in keys:
+            row = self.conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND time >= ?",
+                (json.dumps([ cache_id, *key ]), oldest)).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                result[key] = PartData(**value) if value is not None else None
+        return result
+
+    def put(self, cache_id: str,
+            results: dict[Lookup, Optional[PartData]]) -> None:
+        """Store results in the cache, and drop any that have expired"""
+        now = time.time()
+        with self.conn:
+            self.conn.execute("DELETE FROM cache WHERE time < ?",
+                              (now - self.ttl,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                [ (json.dumps([ cache_id, *key ]),
+                   json.dumps(dataclasses.asdict(data) if data else None),
+                   now)
+                  for (key, data) in results.items() ])
+
+    def close(self) -> None:
+        self.conn.close()
+
+class Enricher(BOMEnricher):
+    """Fill in Info.status and Info.alternatives from a backend.
+
+    Lookups are deduplicated across the whole BOM, served from the cache
+    when possible, and otherwise sent to the backend in batches, with a
+    limited number of batches in flight at once."""
+    backend: EnrichBackend
+    cache: Optional[LookupCache]
+    batch_size: int
+    concurrency: int
+
+    def __init__(self, backend: EnrichBackend,
+                 cache: Optional[LookupCache] = None,
+                 batch_size: int = 50,
+                 concurrency: int = 4) -> None:
+        self.backend = backend
+        self.cache = cache
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    @staticmethod
+    def keys(info: Info) -> list[Lookup]:
+        """Return the lookup keys for Info, in order of preference"""
+        keys = []
+        if info.part:
+            keys.append(("part", info.manufacturer, info.part))
+        if info.supplier_part:
+            keys.append(("supplier_part", "", info.supplier_part))
+        return keys
+
+    async def fetch(self, keys: list[Lookup]
+                    ) -> dict[Lookup, Optional[PartData]]:
+        """Look up keys from the backend, in concurrent batches"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_batch(batch: list[Lookup]):
+            async with semaphore:
+                return await self.backend.lookup(batch)
+
+        batches = [ keys[i:i + self.batch_size]
+                    for i in range(0, len(keys), self.batch_size) ]
+        results: dict[Lookup, Optional[PartData]] = {}
+        for result in await asyncio.gather(*map(fetch_batch, batches)):
+            results.update(result)
+        return results
+
+    def __call__(self, parts: dict[Desig, Part]) -> None:
+        # Gather unique lookups
+        infos = [ info for part in parts.values()
+                  for (rules, info) in part.variants ]
+        keys = sorted({ key for info in infos for key in self.keys(info) })
+
+        # Use cached results where possible, and fetch the rest
+        cache_id = self.backend.cache_id()
+        results = self.cache.get(cache_id, keys) if self.cache else {}
+        missing = [ k for k in keys if k not in results ]
+        if missing:
+            fetched = asyncio.run(self.fetch(missing))
+            if self.cache:
+                self.cache.put(cache_id, fetched)
+            results.update(fetched)
+        log("Enriched with %d unique lookups (%d cached, %d looked up)",
+            len(keys), len(keys) - len(missing), len(missing))
+
+        # Update BOM, preferring results by part number over results by
+        # supplier part number for each field
+        for info in infos:
+            found = [ data for data in map(results.get, self.keys(info))
+                      if data is not None ]
+            for data in reversed(found):
+                if data.status:
+                    info.status = data.status
+                if data.alternatives:
+                    info.alternatives = data.alternatives
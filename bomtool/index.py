@@ -0,0 +1,93 @@
+import sqlite3
+import hashlib
+
+from typing import Optional
+
+from .bom import *
+from .manifest import hash_file, tool_version
+
+# Where-used result: (project, rules, desig, manufacturer, part, supplier_part)
+WhereUsed = tuple[str, str, str, str, str, str]
+
+class WhereUsedIndex:
+    """Persistent index of which projects and variants use each part.
+
+    Each project is indexed along with a hash of its input files, so
+    updating the index only re-reads projects that have changed."""
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS projects
+                    (project TEXT PRIMARY KEY, hash TEXT);
+                CREATE TABLE IF NOT EXISTS parts
+                    (project TEXT, rules TEXT, desig TEXT,
+                     manufacturer TEXT, part TEXT, supplier_part TEXT);
+                CREATE INDEX IF NOT EXISTS parts_project ON parts (project);
+                CREATE INDEX IF NOT EXISTS parts_part ON parts (part);
+                CREATE INDEX IF NOT EXISTS parts_supplier_part
+                    ON parts (supplier_part);
+            """)
+
+    @staticmethod
+    def inputs_hash(inputs: list[str]) -> str:
+        """Hash the contents of a project's input files"""
+        h = hashlib.sha256(tool_version().encode("utf-8"))
+        for path in inputs:
+            h.update(str(hash_file(path)).encode("utf-8"))
+        return h.hexdigest()
+
+    def update(self, project: str, inputs: list[str],
+               reader: BOMReader) -> bool:
+        """Index a project from the given reader, unless its input files
+        are unchanged since it was last indexed.  Returns True if the
+        project was re-indexed."""
+        digest = self.inputs_hash(inputs)
+        row = self.conn.execute("SELECT hash FROM projects WHERE project = ?",
+                                (project,)).fetchone()
+        if row is not None and row[0] == digest:
+            return False
+
+        rows = []
+        for part in reader():
+            for (rules, info) in part.variants:
+                rows.append((project, rules, part.desig, info.manufacturer,
+                             info.part, info.supplier_part))
+
+        with self.conn:
+            self.conn.execute("DELETE FROM parts WHERE project = ?",
+                              (project,))
+            self.conn.executemany("INSERT INTO parts VALUES (?, ?, ?, ?, ?, ?)",
+                                  rows)
+            self.conn.execute("INSERT OR REPLACE INTO projects VALUES (?, ?)",
+                              (project, digest))
+        return True
+
+    def remove(self, project: str) -> int:
+        """Remove a project from the index.  Returns the number of
+        projects removed, which is 0 if it wasn't indexed."""
+        with self.conn:
+            self.conn.execute("DELETE FROM parts WHERE project = ?",
+                              (project,))
+            cursor = self.conn.execute("DELETE FROM projects WHERE project = ?",
+                                       (project,))
+        return cursor.rowcount
+
+    def query(self, part: str,
+              manufacturer: Optional[str] = None) -> list[WhereUsed]:
+        """Return every use of a part, matching either the manufacturer
+        part number or the supplier part number."""
+        sql = ("SELECT project, rules, desig, manufacturer, part, "
+               "supplier_part FROM parts WHERE "
+               "(part = ? OR supplier_part = ?)")
+        args = [ part, part ]
+        if manufacturer is not None:
+            sql += " AND manufacturer = ?"
+            args.append(manufacturer)
+        return self.conn.execute(sql, args).fetchall()
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,105 @@
+import os
+import json
+import glob
+import hashlib
+import tempfile
+
+from typing import Any, Optional, Sequence
+
+def hash_file(path: str) -> Optional[str]:
+    """Return the SHA-256 of a file's contents, or None if missing"""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+def tool_version(scripts: Sequence[str] = ()) -> str:
+    """Hash of this package's source, plus any scripts that drive it,
+    so that any change to the tool invalidates previous outputs"""
+    h = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__),
+                                              "*.py"))) + list(scripts):
+        h.update(os.path.basename(path).encode("utf-8"))
+        h.update(str(hash_file(path)).encode("utf-8"))
+    return h.hexdigest()
+
+class Manifest:
+    """Record of the outputs produced by previous runs.  Each entry is
+    keyed by the list of output files, and stores a hash of everything
+    that went into them (input file contents, variants, writer options,
+    and tool version) along with the hashes of the outputs themselves.
+
+    If a later run has the same key and the outputs still match their
+    hashes, there's nothing to do."""
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def load(self) -> dict[str, Any]:
+        """Return all manifest entries"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def entry_name(outputs: list[str]) -> str:
+        """Return the name of the entry for a list of outputs"""
+        return " ".join(os.path.abspath(p) for p in outputs)
+
+    @staticmethod
+    def make_key(inputs: list[str], options: dict[str, Any],
+                 scripts: Sequence[str] = ()) -> str:
+        """Build a key from the input file contents, options, and the
+        source of the tool, including the given scripts"""
+        data = {
+            "inputs": [ (os.path.abspath(p), hash_file(p)) for p in inputs ],
+            "options": options,
+            "version": tool_version(scripts),
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def up_to_date(self, outputs: list[str], key: str) -> bool:
+        """Return True if the outputs were already produced with this
+        key, and haven't changed since"""
+        entry = self.load().get(self.entry_name(outputs))
+        if entry is None or entry["key"] != key:
+            return False
+        return all(hash_file(p) == entry["outputs"].get(os.path.abspath(p))
+                   for p in outputs)
+
+    def record(self, outputs: list[str], key: str) -> None:
+        """Record that the outputs were produced with this key"""
+        entry = {
+            "key": key,
+            "outputs": { os.path.abspath(p): hash_file(p) for p in outputs },
+        }
+
+        # Hold a lock while updating, so parallel runs sharing the
+        # manifest don't drop each other's entries.  fcntl is Unix-only,
+        # so import it here to keep the rest of the package portable.
+        import fcntl
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self.load()
+            data[self.entry_name(outputs)] = entry
+
+            # Replace atomically, so an interrupted run can't leave a
+            # truncated manifest behind
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile("w", dir=directory,
+                                             delete=False) as f:
+                try:
+                    json.dump(data, f, indent=1, sort_keys=True)
+                    f.write('\n')
+                except BaseException:
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, self.path)
@@ -0,0 +1,230 @@
+import re
+import json
+import operator
+import dataclasses
+
+from typing import Any, Callable, Optional
+
+from .bom import *
+
+class SchemaError(Exception):
+    pass
+
+@dataclasses.dataclass(frozen=True)
+class Field:
+    """A single BOM field, and how it maps to each file format."""
+    name: str                   # Info attribute, or key in Info.extra
+    column: str                 # Spreadsheet column header
+    eagle: Optional[str] = None # Eagle attribute is BOM_VAR_n_{eagle}
+    width: float = 20           # Spreadsheet column width
+    wrap: bool = False          # Wrap text in spreadsheet column
+
+# Fields that are handled specially by readers and writers, rather than
+# being copied directly to and from Info.
+SPECIAL = ( 'dnp', 'qty', 'desig', 'rules' )
+
+# Eagle attribute suffixes and spreadsheet columns that are written
+# outside of the schema
+RESERVED_EAGLE = ( 'DNP', 'VARIANT_RULES' )
+RESERVED_COLUMNS = ( 'Eagle value', 'Eagle package' )
+
+# Plain string fields that exist as attributes of Info
+INFO_FIELDS = ( 'package', 'description', 'manufacturer', 'part', 'supplier',
+                'supplier_part', 'notes', 'alternatives', 'status' )
+
+DEFAULT_FIELDS = [
+    Field('dnp', 'Notes', width=7),
+    Field('qty', 'Qty', width=3),
+    Field('package', 'Package', 'PACKAGE', width=11),
+    Field('description', 'Description', 'DESCRIPTION', width=32),
+    Field('manufacturer', 'Manufacturer', 'MANUFACTURER', width=20),
+    Field('part', 'Part', 'PART', width=28),
+    Field('desig', 'Designators', width=28, wrap=True),
+    Field('supplier', 'Supplier', 'SUPPLIER', width=13),
+    Field('supplier_part', 'Supplier part', 'SUPPLIER_PART', width=35),
+    Field('rules', 'Variant rule', width=20),
+    Field('notes', 'Other notes', 'NOTES', width=48, wrap=True),
+    Field('alternatives', 'Alternatives', 'ALTERNATIVES', width=48, wrap=True),
+    Field('status', 'Status', 'STATUS', width=48, wrap=True),
+]
+
+class Schema:
+    """Ordered list of BOM fields, which are compiled into extractor
+    and emitter functions for each file format.  Build these once, then
+    call them for each part."""
+    fields: list[Field]
+
+    def __init__(self, fields: list[Field]) -> None:
+        self.fields = fields
+
+        names = [ f.name for f in fields ]
+        columns = [ f.column for f in fields ]
+        eagle = [ f.eagle for f in fields if f.eagle is not None ]
+        for name in SPECIAL + INFO_FIELDS:
+            if name not in names:
+                raise SchemaError(f"Schema is missing field {name}")
+        for f in fields:
+            if names.count(f.name) != 1:
+                raise SchemaError(f"Duplicate field {f.name} in schema")
+            if columns.count(f.column) != 1:
+                raise SchemaError(f"Duplicate column {f.column} in schema")
+            if f.column in RESERVED_COLUMNS:
+                raise SchemaError(f"Column {f.column} is reserved")
+            if f.name not in SPECIAL and f.eagle is None:
+                raise SchemaError(f"Field {f.name} needs an Eagle name")
+            if f.eagle is not None and eagle.count(f.eagle) != 1:
+                raise SchemaError(f"Duplicate Eagle name {f.eagle} in schema")
+            if f.eagle in RESERVED_EAGLE:
+                raise SchemaError(f"Eagle name {f.eagle} is reserved")
+
+        # Fields that are stored in Info: the Info attributes in the order
+        # that Info takes them, followed by any extra fields
+        by_name = { f.name: f for f in fields }
+        self.data = ([ by_name[name] for name in INFO_FIELDS ] +
+                     [ f for f in fields if f.name not in SPECIAL + INFO_FIELDS ])
+        self.extra = [ f.name for f in self.data[len(INFO_FIELDS):] ]
+
+        # Getter for each field in self.data.  Info.extra always holds
+        # the extra fields in order, since Info is built by make_info().
+        self.getters: dict[str, Callable[[Info], str]] = {}
+        for name in INFO_FIELDS:
+            self.getters[name] = operator.attrgetter(name)
+        def extra_getter(i: int) -> Callable[[Info], str]:
+            return lambda info: info.extra[i][1]
+        for (i, name) in enumerate(self.extra):
+            self.getters[name] = extra_getter(i)
+
+        # Eagle attribute names for each variant row, filled in as needed
+        self.eagle_key_cache: dict[int, list[str]] = {}
+
+    @classmethod
+    def load(cls, path: str) -> 'Schema':
+        """Load extra fields from a JSON config file, for example:
+
+            { "fields": [ { "name": "datasheet", "column": "Datasheet",
+                            "eagle": "DATASHEET", "width": 40 } ] }
+
+        Extra fields are appended after the default fields."""
+        with open(path) as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise SchemaError(f"Expected a JSON object in {path}")
+        fields = config.get("fields", [])
+        if not isinstance(fields, list):
+            raise SchemaError(f"Expected a list of fields in {path}")
+        for f in fields:
+            if not isinstance(f, dict):
+                raise SchemaError(f"Bad field {f!r} in {path}")
+        try:
+            extra = [ Field(**f) for f in fields ]
+        except TypeError as e:
+            raise SchemaError(f"Bad field in {path}: {str(e)}")
+        for field in extra:
+            for attr in ('name', 'column'):
+                if not isinstance(getattr(field, attr), str):
+                    raise SchemaError(f"Bad {attr} in field {field.name} "
+                                      f"in {path}")
+            if (isinstance(field.width, bool) or
+                not isinstance(field.width, (int, float))):
+                raise SchemaError(f"Bad width in field {field.name} in {path}")
+            if not isinstance(field.wrap, bool):
+                raise SchemaError(f"Bad wrap in field {field.name} in {path}")
+            if field.eagle is None or not re.match('^[A-Z0-9_]+$', field.eagle):
+                raise SchemaError(f"Bad Eagle name {field.eagle} in {path}")
+        return cls(DEFAULT_FIELDS + extra)
+
+    def column(self, name: str) -> str:
+        """Return the spreadsheet column header for a field"""
+        for f in self.fields:
+            if f.name == name:
+                return f.column
+        raise KeyError(name)
+
+    def make_info(self, values: tuple, **kwargs: Any) -> Info:
+        """Build Info from values in the order of self.data"""
+        if self.extra:
+            n = len(INFO_FIELDS)
+            kwargs['extra'] = tuple(zip(self.extra, values[n:]))
+            values = values[:n]
+        return Info(*values, **kwargs)
+
+    def csv_extractor(self, fieldnames: list[str]
+                      ) -> Callable[[dict[str, str]], Info]:
+        """Return a function that builds Info from a CSV row.  Default
+        fields are required, extra fields are optional."""
+        for f in self.fields:
+            if f.name not in self.extra and f.column not in fieldnames:
+                raise KeyError(f.column)
+
+        present = [ f.column for f in self.data if f.column in fieldnames ]
+        getter = operator.itemgetter(*present)
+        if len(self.data) == len(present):
+            def extract(row: dict[str, str]) -> Info:
+                return self.make_info(getter(row))
+        else:
+            # Fill missing extra columns with blanks
+            def extract(row: dict[str, str]) -> Info:
+                values = dict(zip(present, getter(row)))
+                return self.make_info(tuple(values.get(f.column, '')
+                                            for f in self.data))
+        return extract
+
+    def csv_columns(self, eagle_value: bool) -> list[str]:
+        """Return the list of CSV column headers"""
+        columns = [ f.column for f in self.fields ]
+        if eagle_value:
+            columns += [ 'Eagle value', 'Eagle package' ]
+        return columns
+
+    def csv_emitter(self, eagle_value: bool
+                    ) -> Callable[[dict[str, str], Info], list[str]]:
+        """Return a function that builds a CSV row from Info, given
+        values for the special fields."""
+        # One getter per column, taking the special values and Info
+        Getter = Callable[[dict[str, str], Info], str]
+
+        def special_getter(name: str) -> Getter:
+            return lambda special, info: special[name]
+
+        def info_getter(get: Callable[[Info], str]) -> Getter:
+            return lambda special, info: get(info)
+
+        getters: list[Getter] = []
+        for f in self.fields:
+            if f.name in SPECIAL:
+                getters.append(special_getter(f.name))
+            else:
+                getters.append(info_getter(self.getters[f.name]))
+        if eagle_value:
+            getters.append(lambda special, info: info.eagle_value)
+            getters.append(lambda special, info: info.eagle_package)
+
+        def emit(special: dict[str, str], info: Info) -> list[str]:
+            return [ get(special, info) for get in getters ]
+        return emit
+
+    def eagle_keys(self, n: int) -> list[str]:
+        """Return the Eagle attribute names for variant row n"""
+        if n not in self.eagle_key_cache:
+            self.eagle_key_cache[n] = [ f'BOM_VAR_{n}_{f.eagle}'
+                                        for f in self.data ]
+        return self.eagle_key_cache[n]
+
+    def eagle_extractor(self) -> Callable[..., Info]:
+        """Return a function that builds Info from Eagle attributes for
+        variant row n."""
+        def extract(data: dict[str, str], n: int, **kwargs: Any) -> Info:
+            values = tuple(data.get(k, '') for k in self.eagle_keys(n))
+            return self.make_info(values, **kwargs)
+        return extract
+
+    def eagle_emitter(self) -> Callable[[Info], list[tuple[str, str]]]:
+        """Return a function that gives the BOM_VAR_n_* attribute name
+        suffixes and values for Info."""
+        getters = [ (str(f.eagle), self.getters[f.name]) for f in self.data ]
+
+        def emit(info: Info) -> list[tuple[str, str]]:
+            return [ (name, get(info)) for (name, get) in getters ]
+        return emit
+
+DEFAULT_SCHEMA = Schema(DEFAULT_FIELDS)
@@ -23,7 +23,7 @@ class SheetReader(CSVReader):
             temp_csv = os.path.join(tempdir, "converted.csv")
             print(f"Converting from {self.path}")
             subprocess.run(["ssconvert", self.path, temp_csv], check=True)
-            yield from CSVReader(temp_csv)()
+            yield from CSVReader(temp_csv, self.schema)()
 
 class SheetWriter(CSVWriter):
     """Write a temporary XLSX file to get formatting correct, then use
@@ -48,7 +48,8 @@ class SheetWriter(CSVWriter):
         temp_csv = os.path.join(tempdir, "out.csv")
         writer = CSVWriter(path=temp_csv,
                            merge=self.merge,
-                           eagle_value=self.eagle_value)
+                           eagle_value=self.eagle_value,
+                           schema=self.schema)
         writer(parts, variants)
 
         # Now re-read the CSV
@@ -103,32 +104,20 @@ class SheetWriter(CSVWriter):
         format_row(0, { 'bg_color': '#ccddff', 'bold': True, 'bottom': 1 })
 
         # DNP rows are styled differently
+        notes_col = field(self.schema.column('dnp'))
+        desig_col = field(self.schema.column('desig'))
         for row in range(len(data)):
-            if data[row][field('Notes')] == 'DNP':
+            if data[row][notes_col] == 'DNP':
                 format_row(row, { 'bg_color': '#cccccc', 'italic': True })
-                format_cell(row, field('Designators'),
-                            { 'font_strikeout': True })
+                format_cell(row, desig_col, { 'font_strikeout': True })
 
         # Column sizes
-        desig_width = 28
-
-        def set_width(name: str, width: float, wrap: bool = False) -> None:
-            worksheet.set_column(field(name), field(name), width)
-            if wrap:
-                format_col(field(name), { 'text_wrap': True })
-        set_width('Notes', 7)
-        set_width('Qty', 3)
-        set_width('Package', 11)
-        set_width('Description', 32)
-        set_width('Manufacturer', 20)
-        set_width('Part', 28)
-        set_width('Designators', desig_width, True)
-        set_width('Supplier', 13)
-        set_width('Supplier part', 35)
-        set_width('Variant rule', 20)
-        set_width('Other notes', 48, True)
-        set_width('Alternatives', 48, True)
-        set_width('Status', 48, True)
+        for sf in self.schema.fields:
+            worksheet.set_column(field(sf.column), field(sf.column), sf.width)
+            if sf.wrap:
+                format_col(field(sf.column), { 'text_wrap': True })
+        desig_width = [ sf.width for sf in self.schema.fields
+                        if sf.name == 'desig' ][0]
 
         if 0:
             # Set row height to account for wraps in Designators.
@@ -136,7 +125,7 @@ class SheetWriter(CSVWriter):
             # Gnumeric does not.  But, setting explicit height disables
             # any automatic sizing, which I'd prefer to keep for now.
             for row in range(len(data)):
-                n = len(data[row][field('Designators')]) // (desig_width - 2)
+                n = int(len(data[row][desig_col]) // (desig_width - 2))
                 worksheet.set_row(row, 18 * (n + 1))
                 format_row(row, { 'valign': 'top' } )
 